@@ -1,10 +1,12 @@
 import json
+import math
 import os
 import re
 from pathlib import Path
 import fitz  # PyMuPDF
+import numpy as np
 import pymupdf4llm
-from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import logging
 from datetime import datetime
 
@@ -24,6 +26,100 @@ else:
     INPUT_DIR = Path("PDFs")
     OUTPUT_DIR = Path("output1a")
 
+# Pre-compiled regex patterns. These run once per text block on every page,
+# so compile them once at import time instead of on each call.
+_PAGE_PATTERN = r'^(Page\s*)?\d+(\s*of\s*\d+)?$'  # "Page X of Y" or just a number
+
+_DATE_PATTERNS = (
+    r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}',  # MM/DD/YYYY, MM-DD-YYYY
+    r'\d{4}[/-]\d{1,2}[/-]\d{1,2}',    # YYYY/MM/DD, YYYY-MM-DD
+    r'\b(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}\b',  # Month DD, YYYY
+    r'\b\d{1,2}\s+(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{4}\b',  # DD Month YYYY
+    r'\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\.?\s+\d{1,2},?\s+\d{4}\b',  # Abbreviated months
+    r'^\d{4}$',  # Just a year
+)
+
+_COPYRIGHT_PATTERN = r'(copyright|©|\(c\)|version|ver\.|v\d+)'  # Copyright notices, version numbers
+
+_JUNK_PATTERNS = (
+    r'^\d+$',  # Just numbers
+    r'^(?-i:[ivxlcdmIVXLCDM])+$',  # Roman numerals alone (ASCII only)
+    r'^[a-z]\.?$',  # Single letters
+    r'^\W+$',  # Only special characters
+)
+
+# Except for the whole-string patterns (roman numerals, only special
+# characters), every junk pattern needs a digit or one of c/v/© to match.
+_JUNK_HINT_CHARS = frozenset('0123456789©cCvV')
+_WHOLE_STRING_JUNK_RE = re.compile(r'^(?:[ivxlcdmIVXLCDM]+|\W+)$')
+
+# All "reject" patterns combined into one alternation so a candidate string is
+# scanned once instead of once per pattern.
+_JUNK_UNION = re.compile(
+    "|".join(f"(?:{p})" for p in (_PAGE_PATTERN, *_DATE_PATTERNS, _COPYRIGHT_PATTERN, *_JUNK_PATTERNS)),
+    re.IGNORECASE,
+)
+
+_REPEAT_RE = re.compile(r'(.{1,2})\1{3,}')
+_MD_BOLD_RE = re.compile(r'\*\*([^*]+)\*\*')
+_NONWORD_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+_WORD_REPEAT_RE = re.compile(r'\b(\w+)(\s+\1)+\b')
+
+# Punctuation is turned into spaces with str.translate, which skips the regex
+# engine entirely. The table only covers ASCII ([^\w\s] restricted to ASCII),
+# so non-ASCII text still goes through _NONWORD_RE.
+_ASCII_PUNCTUATION = ''.join(
+    c for c in map(chr, range(128)) if not (c.isalnum() or c == '_' or c.isspace())
+)
+_PUNCT_SPACE_TABLE = str.maketrans(_ASCII_PUNCTUATION, ' ' * len(_ASCII_PUNCTUATION))
+
+# Single-word indicators are checked against the text's token set; the
+# multi-word phrases still need a substring test.
+_TITLE_TOKENS = frozenset({
+    'rfp', 'proposal', 'report', 'study', 'analysis', 'guide', 'manual',
+    'handbook', 'overview', 'introduction', 'summary', 'research'
+})
+_TITLE_PHRASES = ('request for proposal', 'business plan', 'strategic plan', 'white paper')
+
+# Keywords used to pick the level of bold-text headings
+_MAJOR_SECTION_WORDS = frozenset({'introduction', 'overview', 'guide', 'conclusion'})
+_SUB_SECTION_WORDS = frozenset({'history', 'culture', 'attractions', 'dining', 'shopping'})
+
+# Text extraction flags for the font analysis. Ligatures are expanded
+# (cheaper to extract and easier to match); images are never requested.
+_SPAN_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES & ~fitz.TEXT_PRESERVE_IMAGES
+
+# Font size (relative to body text) at which a style becomes H3, H2, H1 and
+# the document title; indexed by how many of the ratios a size reaches.
+_HEADING_SIZE_RATIOS = np.array([1.2, 1.5, 1.7, 2.0])
+_HEADING_SIZE_LABELS = (None, "H3", "H2", "H1", "TITLE")
+
+# Tags a markdown line as a '#' heading or a standalone **bold** line in one match.
+_LINE_CLASSIFIER = re.compile(r'^(?P<hashes>#+)\s*(?P<htext>.*?)\s*$|^\*\*(?P<btext>[^*]+)\*\*\s*$')
+
+def _word_tokens(text_lower: str) -> frozenset:
+    """
+    Split lowercased text into its set of words, ignoring punctuation.
+    """
+    if text_lower.isascii():
+        return frozenset(text_lower.translate(_PUNCT_SPACE_TABLE).split())
+    return frozenset(_NONWORD_RE.sub(' ', text_lower).split())
+
+def _alpha_ratio_ok(text: str, threshold: float = 0.5) -> bool:
+    """
+    Check that at least `threshold` of the characters are word characters or
+    whitespace, stopping as soon as enough have been counted.
+    """
+    need = math.ceil(len(text) * threshold)
+    count = 0
+    for c in text:
+        if c.isalnum() or c == '_' or c.isspace():
+            count += 1
+            if count >= need:
+                return True
+    return count >= need
+
 def is_likely_junk(text: str) -> bool:
     """
     Enhanced function to check if a string is likely a footer, page number, date, or other non-heading text.
@@ -34,107 +130,105 @@ def is_likely_junk(text: str) -> bool:
     if len(text_clean) < 3:
         return True
     
-    # Filter out lines that look like "Page X of Y" or just a number.
-    if re.fullmatch(r'(Page\s*)?\d+(\s*of\s*\d+)?', text_clean, re.IGNORECASE):
-        return True
-    
-    # Filter out dates in various formats
-    date_patterns = [
-        r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}',  # MM/DD/YYYY, MM-DD-YYYY
-        r'\d{4}[/-]\d{1,2}[/-]\d{1,2}',    # YYYY/MM/DD, YYYY-MM-DD
-        r'\b(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}\b',  # Month DD, YYYY
-        r'\b\d{1,2}\s+(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{4}\b',  # DD Month YYYY
-        r'\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\.?\s+\d{1,2},?\s+\d{4}\b',  # Abbreviated months
-        r'^\d{4}$',  # Just a year
-    ]
-    
-    for pattern in date_patterns:
-        if re.search(pattern, text_clean, re.IGNORECASE):
-            return True
-    
-    # Filter out copyright notices, version numbers, etc.
-    if re.search(r'(copyright|©|\(c\)|version|ver\.|v\d+)', text_clean, re.IGNORECASE):
+    # Filter out page numbers, dates, copyright/version notices and other
+    # common junk in a single pass over the string. Most text has none of the
+    # hint characters, so only the cheap anchored patterns can apply to it
+    # (non-ASCII text always gets the full scan, as \d also matches other digits).
+    if text_clean.isascii() and _JUNK_HINT_CHARS.isdisjoint(text_clean):
+        junk_re = _WHOLE_STRING_JUNK_RE
+    else:
+        junk_re = _JUNK_UNION
+    if junk_re.search(text_clean):
         return True
     
     # Filter out text that's mostly punctuation or special characters
-    if len(re.sub(r'[^\w\s]', '', text_clean)) < len(text_clean) * 0.5:
+    if not _alpha_ratio_ok(text_clean):
         return True
     
-    # Filter out very common junk patterns
-    junk_patterns = [
-        r'^\d+$',  # Just numbers
-        r'^[ivxlcdm]+$',  # Roman numerals alone
-        r'^[a-z]\.?$',  # Single letters
-        r'^\W+$',  # Only special characters
-    ]
-    
-    for pattern in junk_patterns:
-        if re.match(pattern, text_clean.lower()):
-            return True
-    
     return False
 
-def reconstruct_fragmented_text(text_blocks, same_line_threshold=3.0):
+def reconstruct_fragmented_text(texts, sizes, bolds, pages, bboxes, same_line_threshold=3.0):
     """
     Reconstruct text that has been fragmented by PDF extraction.
     Groups text blocks that are on the same line and have the same style.
+    Blocks are given as parallel arrays: texts (list of str), sizes, bolds,
+    pages (1-D arrays) and bboxes (N x 4 array).
     """
-    if not text_blocks:
+    if not texts:
         return []
     
-    # Group by line (y-coordinate) and style
-    lines = defaultdict(list)
+    # Group by style and line (y-coordinate): one sort puts every line's
+    # blocks next to each other, already ordered left to right.
+    style_ids = sizes.astype(np.int32) * 2 + bolds
+    y_groups = np.round(bboxes[:, 1].astype(np.float64) / same_line_threshold)
+    order = np.lexsort((bboxes[:, 0], y_groups, style_ids))
     
-    for block in text_blocks:
-        # Use y-coordinate and style as grouping key
-        line_key = (round(block['bbox'][1] / same_line_threshold), block['style'])
-        lines[line_key].append(block)
+    sorted_styles = style_ids[order]
+    sorted_y_groups = y_groups[order]
+    line_starts = np.flatnonzero(
+        (np.diff(sorted_styles) != 0) | (np.diff(sorted_y_groups) != 0)
+    ) + 1
+    line_bounds = zip(np.concatenate(([0], line_starts)), np.concatenate((line_starts, [len(order)])))
     
     # Reconstruct text for each line
     reconstructed = []
-    for (y_group, style), blocks in lines.items():
-        # Sort by x-coordinate (left to right)
-        blocks.sort(key=lambda b: b['bbox'][0])
+    for start, end in line_bounds:
+        line_order = order[start:end]
         
         # Combine text intelligently - handle fragmentation better
         seen_texts = set()
         unique_parts = []
         
-        for block in blocks:
-            text = block['text'].strip()
+        for idx in line_order:
+            text = texts[idx].strip()
             if text and text not in seen_texts:
                 # Clean individual fragments first
-                text = re.sub(r'(.{1,2})\1{3,}', r'\1', text)  # Remove excessive repetition
+                text = _REPEAT_RE.sub(r'\1', text)  # Remove excessive repetition
                 if len(text) > 1:  # Keep only meaningful fragments
                     unique_parts.append(text)
                     seen_texts.add(text)
         
-        # Smart joining - don't just concatenate, try to form proper words
+        # Smart joining - don't just concatenate, try to form proper words.
+        # The length of the last word is tracked as parts are appended.
         combined_text = ''
+        last_word_len = 0
         for i, part in enumerate(unique_parts):
+            part_words = part.split()
             if i == 0:
                 combined_text = part
+                last_word_len = len(part_words[-1])
             else:
                 # If previous text ends with an incomplete word and current starts with letters
                 if (combined_text and combined_text[-1].isalpha() and 
-                    part and part[0].islower() and len(combined_text.split()[-1]) < 8):
+                    part and part[0].islower() and last_word_len < 8):
                     combined_text += part  # Join without space for word completion
+                    if len(part_words) == 1:
+                        last_word_len += len(part_words[0])
+                    else:
+                        last_word_len = len(part_words[-1])
                 else:
                     combined_text += ' ' + part  # Normal space separation
+                    last_word_len = len(part_words[-1])
         
         # Final cleanup
-        combined_text = re.sub(r'\s+', ' ', combined_text).strip()
-        combined_text = re.sub(r'\b(\w+)(\s+\1)+\b', r'\1', combined_text)  # Remove word repetition
+        combined_text = _WS_RE.sub(' ', combined_text).strip()
+        combined_text = _WORD_REPEAT_RE.sub(r'\1', combined_text)  # Remove word repetition
         
         if combined_text and not is_likely_junk(combined_text) and len(combined_text) > 2:
             # Use the leftmost block's properties
-            first_block = blocks[0]
+            first_idx = line_order[0]
+            bbox = tuple(bboxes[first_idx].tolist())
+            # Lowercase text and word set are computed once here and reused
+            # by the downstream heuristics (e.g. is_likely_title)
+            combined_lower = combined_text.lower()
             reconstructed.append({
                 'text': combined_text,
-                'style': style,
-                'page': first_block['page'],
-                'bbox': first_block['bbox'],
-                'position_score': first_block['bbox'][1]  # Y-coordinate for sorting
+                'text_lower': combined_lower,
+                'tokens': _word_tokens(combined_lower),
+                'style': (int(sizes[first_idx]), int(bolds[first_idx])),
+                'page': int(pages[first_idx]),
+                'bbox': bbox,
+                'position_score': bbox[1]  # Y-coordinate for sorting
             })
     
     return reconstructed
@@ -144,12 +238,12 @@ def analyze_document_structure(doc):
     Analyze the entire document to understand its structure and determine
     appropriate font size mappings for titles and headings.
     """
-    font_analysis = Counter()
-    all_text_blocks = []
+    # Span data is kept as parallel arrays rather than one dict per span
+    texts, sizes, bolds, pages, bboxes = [], [], [], [], []
     
     # Collect all text with font information
     for page_num, page in enumerate(doc):
-        blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
+        blocks = page.get_text("dict", flags=_SPAN_TEXT_FLAGS)["blocks"]
         
         for block in blocks:
             if block['type'] == 0:  # Text block
@@ -157,40 +251,47 @@ def analyze_document_structure(doc):
                     for span in line["spans"]:
                         text = span['text'].strip()
                         if text:
-                            style_key = (round(span['size']), 1 if span['flags'] & 16 else 0)
-                            font_analysis[style_key] += len(text)
-                            
-                            all_text_blocks.append({
-                                'text': text,
-                                'style': style_key,
-                                'page': page_num,  # Keep 0-based page numbering
-                                'bbox': span['bbox']
-                            })
-    
-    # Reconstruct fragmented text
-    reconstructed_blocks = reconstruct_fragmented_text(all_text_blocks)
+                            texts.append(text)
+                            sizes.append(round(span['size']))
+                            bolds.append(1 if span['flags'] & 16 else 0)
+                            pages.append(page_num)  # Keep 0-based page numbering
+                            bboxes.append(span['bbox'])
     
     # Determine font hierarchy
-    if not font_analysis:
+    if not texts:
         return [], {}
     
-    # Find body text (most common font)
-    body_style = font_analysis.most_common(1)[0][0]
+    sizes = np.asarray(sizes, dtype=np.int16)
+    bolds = np.asarray(bolds, dtype=np.int8)
+    pages = np.asarray(pages, dtype=np.int32)
+    bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+    
+    # Reconstruct fragmented text
+    reconstructed_blocks = reconstruct_fragmented_text(texts, sizes, bolds, pages, bboxes)
+    
+    # Total text length per (size, bold) style
+    style_ids = sizes.astype(np.int32) * 2 + bolds
+    text_lens = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    style_totals = np.bincount(style_ids, weights=text_lens)
+    unique_styles, first_seen = np.unique(style_ids, return_index=True)
+    
+    # Find body text (most common font; ties go to the style seen first)
+    body_id = unique_styles[np.lexsort((first_seen, -style_totals[unique_styles]))[0]]
+    body_style = (int(body_id) // 2, int(body_id) % 2)
     body_size = body_style[0]
     
-    # Create intelligent font mapping based on size relationships
-    font_mapping = {}
-    sorted_fonts = sorted(font_analysis.keys(), key=lambda x: x[0], reverse=True)
+    # Create intelligent font mapping based on size relationships: the number
+    # of size thresholds a style reaches picks its level.
+    style_sizes = unique_styles // 2
+    style_bolds = unique_styles % 2
+    thresholds = body_size * _HEADING_SIZE_RATIOS
+    levels = np.searchsorted(thresholds, style_sizes, side='right')
     
-    for size, is_bold in sorted_fonts:
-        if size >= body_size * 2:  # Significantly larger = document title
-            font_mapping[(size, is_bold)] = "TITLE"
-        elif size >= (body_size * 1.7):   # Large = H1
-            font_mapping[(size, is_bold)] = "H1"
-        elif size >= body_size * 1.5:   # Medium-large = H2
-            font_mapping[(size, is_bold)] = "H2"
-        elif size >= body_size * 1.2:   # Slightly larger = H3
-            font_mapping[(size, is_bold)] = "H3"
+    font_mapping = {}
+    for i in np.argsort(-style_sizes, kind='stable'):
+        size, is_bold = int(style_sizes[i]), int(style_bolds[i])
+        if levels[i]:
+            font_mapping[(size, is_bold)] = _HEADING_SIZE_LABELS[levels[i]]
         elif size == body_size and is_bold:  # Same size but bold = H4
             font_mapping[(size, is_bold)] = "H4"
     
@@ -199,11 +300,13 @@ def analyze_document_structure(doc):
     
     return reconstructed_blocks, font_mapping
 
-def is_likely_title(text, position_score, page_num, font_level):
+def is_likely_title(text, position_score, page_num, font_level, text_lower=None, tokens=None):
     """
     Determine if text is likely to be a document title based on content and position.
+    `text_lower` and `tokens` can be passed in when already computed for the block.
     """
-    text_lower = text.lower()
+    if text_lower is None:
+        text_lower = text.lower()
     
     # Must be on the first page or very early in the document
     if page_num > 2:
@@ -217,15 +320,10 @@ def is_likely_title(text, position_score, page_num, font_level):
     if position_score > 300:  # Too far down the page
         return False
     
-    # Content-based indicators
-    title_indicators = [
-        'rfp', 'request for proposal', 'proposal', 'report', 'study', 'analysis',
-        'guide', 'manual', 'handbook', 'overview', 'introduction', 'summary',
-        'business plan', 'strategic plan', 'white paper', 'research'
-    ]
-    
     # Boost score for title-like content
-    content_score = sum(1 for indicator in title_indicators if indicator in text_lower)
+    if tokens is None:
+        tokens = _word_tokens(text_lower)
+    content_score = len(tokens & _TITLE_TOKENS) + sum(phrase in text_lower for phrase in _TITLE_PHRASES)
     
     # Title should be substantial but not too long
     word_count = len(text.split())
@@ -234,156 +332,92 @@ def is_likely_title(text, position_score, page_num, font_level):
     
     return content_score > 0 or position_score < 200  # Very high position
 
-def create_text_to_page_mapping(doc, llm_content):
-    """
-    Create a mapping from text content to actual page numbers by analyzing both sources.
-    """
-    text_to_page = {}
-    
-    # First, extract all text blocks with their actual page numbers from PyMuPDF
-    for page_num, page in enumerate(doc):
-        page_text = page.get_text()
-        # Split into lines and clean up
-        lines = [line.strip() for line in page_text.split('\n') if line.strip()]
-        
-        for line in lines:
-            # Store both exact match and cleaned version
-            text_to_page[line.lower().strip()] = page_num
-            # Also store without extra spaces and punctuation for better matching
-            cleaned = re.sub(r'[^\w\s]', '', line.lower().strip())
-            if cleaned:
-                text_to_page[cleaned] = page_num
-    
-    # Also try to map based on content similarity
-    llm_lines = llm_content.split('\n')
-    for i, line in enumerate(llm_lines):
-        line_clean = line.strip()
-        if not line_clean:
-            continue
-            
-        # Remove markdown formatting for comparison
-        text_for_comparison = re.sub(r'[#*_`]', '', line_clean).strip().lower()
-        
-        # Try to find this text in our page mapping
-        best_match_page = None
-        best_similarity = 0
-        
-        for pdf_text, page_num in text_to_page.items():
-            if text_for_comparison in pdf_text or pdf_text in text_for_comparison:
-                # Calculate similarity (simple word overlap)
-                text_words = set(text_for_comparison.split())
-                pdf_words = set(pdf_text.split())
-                if text_words and pdf_words:
-                    similarity = len(text_words & pdf_words) / len(text_words | pdf_words)
-                    if similarity > best_similarity:
-                        best_similarity = similarity
-                        best_match_page = page_num
-        
-        if best_match_page is not None and best_similarity > 0.3:  # Reasonable threshold
-            text_to_page[text_for_comparison] = best_match_page
-    
-    return text_to_page
-
-def find_page_for_text(text, text_to_page_mapping, fallback_line_num=0):
-    """
-    Find the actual page number for a given text using the mapping.
-    """
-    # Clean the text for comparison
-    text_clean = re.sub(r'[#*_`]', '', text).strip().lower()
-    text_no_punct = re.sub(r'[^\w\s]', '', text_clean)
-    
-    # Try exact match first
-    if text_clean in text_to_page_mapping:
-        return text_to_page_mapping[text_clean]
-    
-    # Try without punctuation
-    if text_no_punct in text_to_page_mapping:
-        return text_to_page_mapping[text_no_punct]
-    
-    # Try partial matches - look for text that contains our heading
-    for mapped_text, page_num in text_to_page_mapping.items():
-        if text_clean in mapped_text or mapped_text in text_clean:
-            # Additional check for reasonable similarity
-            text_words = set(text_clean.split())
-            mapped_words = set(mapped_text.split())
-            if text_words and mapped_words:
-                similarity = len(text_words & mapped_words) / len(text_words | mapped_words)
-                if similarity > 0.4:  # Good similarity threshold
-                    return page_num
-    
-    # Fallback: estimate based on line number
-    estimated_page = max(0, fallback_line_num // 35)
-    return estimated_page
-
-def extract_with_pymupdf4llm(pdf_path: Path) -> dict:
+def extract_with_pymupdf4llm(doc: fitz.Document) -> dict:
     """
     Use pymupdf4llm to extract text content with better structure understanding.
+    Takes the already opened document so the PDF is not parsed a second time.
     """
     try:
-        # Extract markdown-like content using pymupdf4llm
-        md_text = pymupdf4llm.to_markdown(str(pdf_path))
+        # Extract markdown-like content page by page using pymupdf4llm, so every
+        # heading is tagged with the page it was found on.
+        page_chunks = pymupdf4llm.to_markdown(doc, page_chunks=True)
         
         # Parse the markdown to identify potential headings
-        lines = md_text.split('\n')
         potential_headings = []
+        page_texts = []
+        line_offset = 0  # Line numbers stay relative to the whole document
         
-        logging.info(f"Processing {len(lines)} lines from pymupdf4llm")
+        logging.info(f"Processing {len(page_chunks)} pages from pymupdf4llm")
         
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line:
-                continue
+        for page_num, chunk in enumerate(page_chunks):
+            page_text = chunk['text']
+            page_texts.append(page_text)
+            
+            for line_idx, line in enumerate(page_text.split('\n')):
+                i = line_offset + line_idx
+                line = line.strip()
+                if not line:
+                    continue
+            
+                line_match = _LINE_CLASSIFIER.match(line)
+                if not line_match:
+                    continue
                 
-            # Look for markdown-style headings (#)
-            if line.startswith('#'):
-                level = len(line) - len(line.lstrip('#'))
-                text = line.lstrip('#').strip()
-                logging.info(f"Found heading candidate at line {i}: level={level}, text='{text}'")
+                # Look for markdown-style headings (#)
+                if line_match.group('hashes'):
+                    level = len(line_match.group('hashes'))
+                    text = line_match.group('htext')
+                    logging.info(f"Found heading candidate at line {i}: level={level}, text='{text}'")
                 
-                # Clean up markdown formatting
-                text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)  # Remove **bold** markers
-                text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
+                    # Clean up markdown formatting
+                    if '**' in text:
+                        text = _MD_BOLD_RE.sub(r'\1', text)  # Remove **bold** markers
+                    text = _WS_RE.sub(' ', text)  # Normalize whitespace
 
-                if not is_likely_junk(text) and len(text.strip()) > 0:
-                    if level <= 4: # Cap at H4
-                        potential_headings.append({
-                            'level': min(level, 4),
-                            'text': text,
-                            'line_number': i
-                        })
-                        logging.info(f"Added markdown heading: level {level}, text '{text}'")
+                    if not is_likely_junk(text) and len(text.strip()) > 0:
+                        if level <= 4: # Cap at H4
+                            potential_headings.append({
+                                'level': min(level, 4),
+                                'text': text,
+                                'line_number': i,
+                                'page': page_num
+                            })
+                            logging.info(f"Added markdown heading: level {level}, text '{text}'")
             
-            # Look for bold text formatting (**) as headings
-            elif re.match(r'^\*\*([^*]+)\*\*\s*$', line):
-                bold_match = re.match(r'^\*\*([^*]+)\*\*\s*$', line)
-                text = bold_match.group(1).strip()
+                # Look for bold text formatting (**) as headings
+                else:
+                    text = line_match.group('btext').strip()
                 
-                logging.info(f"Found bold text candidate at line {i}: text='{text}'")
+                    logging.info(f"Found bold text candidate at line {i}: text='{text}'")
                 
-                if not is_likely_junk(text) and len(text.strip()) > 2:
-                    # Determine level based on content and position
-                    if i < 5:  # Early lines are likely titles or main headings
-                        level = 1
-                    elif any(word in text.lower() for word in ['introduction', 'overview', 'guide', 'conclusion']):
-                        level = 1  # Major sections
-                    elif any(word in text.lower() for word in ['history', 'culture', 'attractions', 'dining', 'shopping']):
-                        level = 2  # Sub-sections
-                    elif len(text.split()) <= 3:  # Short titles are usually higher level
-                        level = 2
-                    else:
-                        level = 3  # Detailed subsections
+                    if not is_likely_junk(text) and len(text.strip()) > 2:
+                        tokens = _word_tokens(text.lower())
+                        # Determine level based on content and position
+                        if i < 5:  # Early lines are likely titles or main headings
+                            level = 1
+                        elif not tokens.isdisjoint(_MAJOR_SECTION_WORDS):
+                            level = 1  # Major sections
+                        elif not tokens.isdisjoint(_SUB_SECTION_WORDS):
+                            level = 2  # Sub-sections
+                        elif len(text.split()) <= 3:  # Short titles are usually higher level
+                            level = 2
+                        else:
+                            level = 3  # Detailed subsections
                     
-                    potential_headings.append({
-                        'level': level,
-                        'text': text,
-                        'line_number': i
-                    })
-                    logging.info(f"Added bold heading: level {level}, text '{text}'")
+                        potential_headings.append({
+                            'level': level,
+                            'text': text,
+                            'line_number': i,
+                            'page': page_num
+                        })
+                        logging.info(f"Added bold heading: level {level}, text '{text}'")
+            
+            line_offset += page_text.count('\n')
         
         logging.info(f"Total headings found: {len(potential_headings)}")
         
         return {
-            'content': md_text,
+            'content': ''.join(page_texts),
             'potential_headings': potential_headings
         }
     except Exception as e:
@@ -401,9 +435,8 @@ def extract_outline(pdf_path: Path) -> dict:
         doc = fitz.open(pdf_path)
         logging.info(f"Successfully opened '{pdf_path.name}', starting advanced analysis.")
         
-        llm_data = extract_with_pymupdf4llm(pdf_path)
-        
-        text_to_page_mapping = create_text_to_page_mapping(doc, llm_data.get('content', ''))
+        # Headings come from the markdown page chunks, so each knows its page
+        llm_data = extract_with_pymupdf4llm(doc)
         
         if not llm_data['potential_headings']:
             # Fallback for documents with no detected headings
@@ -414,7 +447,7 @@ def extract_outline(pdf_path: Path) -> dict:
             if meaningful_lines:
                  # Check for a title in the first few bolded lines
                 for line in lines[:10]:
-                    bold_match = re.search(r'\*\*([^*]+)\*\*', line.strip())
+                    bold_match = _MD_BOLD_RE.search(line.strip())
                     if bold_match:
                         potential_title = bold_match.group(1).strip()
                         if len(potential_title.split()) >= 2 and len(potential_title) < 100:
@@ -440,39 +473,37 @@ def extract_outline(pdf_path: Path) -> dict:
                 if line_num < 5 and level <= 2:
                     title_parts.append(text)
                 else:
-                    main_headings.append((text, level, line_num))
+                    main_headings.append((text, level, potential['page']))
         
+        title_part_re = None
         if title_parts:
             document_title = " ".join(title_parts)
+            # Matches any title part, so each heading is checked in one scan
+            title_part_re = re.compile("|".join(re.escape(part.lower()) for part in title_parts))
         
         # Process main headings
-        for text, level, line_num in main_headings:
-            if title_parts and any(part.lower() in text.lower() for part in title_parts):
+        for text, level, page_num in main_headings:
+            if title_part_re and title_part_re.search(text.lower()):
                 continue
                 
-            actual_page = find_page_for_text(text, text_to_page_mapping, line_num)
-            
             level_map = {1: "H1", 2: "H2", 3: "H3", 4: "H4"}
             heading_level = level_map.get(level, "H4")
             
             outline.append({
                 "level": heading_level,
                 "text": text if text.endswith(" ") else text + " ",
-                "page": actual_page
+                "page": page_num
             })
 
     except Exception as e:
         logging.error(f"An unexpected error occurred while processing {pdf_path.name}: {e}", exc_info=True)
         return {"title": "", "outline": []}
 
-    # Final sort and deduplication
-    seen = set()
-    unique_outline = []
+    # Final sort and deduplication (first occurrence of each heading wins)
+    seen = {}
     for item in outline:
-        key = (item['level'], item['text'].lower().strip())
-        if key not in seen:
-            seen.add(key)
-            unique_outline.append(item)
+        seen.setdefault((item['level'], item['text'].lower().strip()), item)
+    unique_outline = list(seen.values())
     
     level_order = {"H1": 1, "H2": 2, "H3": 3, "H4": 4}
     unique_outline.sort(key=lambda x: (x['page'], level_order.get(x['level'], 5)))
@@ -504,20 +535,23 @@ def main():
         return
 
     logging.info(f"Found {len(pdf_files)} PDF file(s) to process.")
-    for file_path in pdf_files:
-        output_filename = file_path.stem + ".json"
-        output_path = OUTPUT_DIR / output_filename
-
-        # Use the single-file processing function to get the data
-        structured_data = process_single_pdf(file_path)
-
-        # Write the returned dictionary to a JSON file
-        try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(structured_data, f, indent=2, ensure_ascii=False)
-            logging.info(f"Successfully wrote output for '{file_path.name}' to '{output_path}'")
-        except Exception as e:
-            logging.error(f"Failed to write JSON for {file_path.name}: {e}")
+
+    # Each PDF is independent, so process them across all cores and write
+    # the JSON results from the parent process.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(process_single_pdf, pdf_files)
+
+        for file_path, structured_data in zip(pdf_files, results):
+            output_filename = file_path.stem + ".json"
+            output_path = OUTPUT_DIR / output_filename
+
+            # Write the returned dictionary to a JSON file
+            try:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(structured_data, f, indent=2, ensure_ascii=False)
+                logging.info(f"Successfully wrote output for '{file_path.name}' to '{output_path}'")
+            except Exception as e:
+                logging.error(f"Failed to write JSON for {file_path.name}: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,102 +1,293 @@
+import asyncio
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from functools import lru_cache
 import chromadb
 from chromadb.config import Settings
 import google.generativeai as genai
 import os
-from thefuzz import fuzz # You'll need to install this library: pip install thefuzz
-import json
-
+import numpy as np
+from rapidfuzz import fuzz, process
+import orjson
+
+
+
+# --- Caching of Gemini calls ---
+# Padded text and query embeddings are served from an in-process LRU cache
+# first and a SQLite file second, so re-submitted selections skip Gemini.
+# The file lives in a cache directory outside the source tree and keeps at
+# most LLM_CACHE_MAX_ROWS entries, dropping the oldest writes first.
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "aih_finale_cache"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_cache.sqlite3"))
+LLM_CACHE_SIZE = 4096
+LLM_CACHE_MAX_ROWS = 20000
+
+_cache_conn = None
+_cache_lock = threading.Lock()
+
+def _cache_key(*parts: str) -> str:
+    return hashlib.blake2b("\0".join(parts).encode(), digest_size=16).hexdigest()
+
+def _get_cache_conn() -> sqlite3.Connection:
+    # One connection shared by every caller; access is serialized by _cache_lock
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(LLM_CACHE_PATH)), exist_ok=True)
+        conn = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB)")
+        _cache_conn = conn
+    return _cache_conn
+
+def _disk_cache_get(key: str):
+    try:
+        with _cache_lock:
+            row = _get_cache_conn().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    except (sqlite3.Error, OSError) as e:
+        print(f"Could not read from the LLM cache: {e}")
+        return None
 
+def _disk_cache_set(key: str, value):
+    try:
+        with _cache_lock:
+            conn = _get_cache_conn()
+            with conn:
+                # REPLACE gives the row a new rowid, so rowid order is write order
+                conn.execute("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, value))
+                conn.execute(
+                    "DELETE FROM cache WHERE rowid <= (SELECT MAX(rowid) FROM cache) - ?",
+                    (LLM_CACHE_MAX_ROWS,),
+                )
+    except (sqlite3.Error, OSError) as e:
+        print(f"Could not write to the LLM cache: {e}")
+
+# --- Prompt templates ---
+# Built once at import time and filled in with str.format_map per call.
+PADDING_PROMPT_TEMPLATE = """
+Act as a subject matter expert. Take the following text and expand upon it by adding two or three sentences of relevant context.
+The goal is to enrich the text with related concepts, examples, or keywords to improve its connection to other content. Do not summarize it.
+
+Original Text: "{original_text}"
+
+Expanded Text:
+"""
+
+VALIDATION_PROMPT_TEMPLATE = """
+Original Text: "{input_text}"
+
+Candidate Chunks:
+{candidates}
+
+Question: For each numbered 'Candidate Chunk', does it provide new, helpful information or a different perspective that deepens the understanding of the 'Original Text'?
+Answer with a JSON list containing one object per candidate, of the form {{"idx": <candidate number>, "helpful": true or false}}.
+"""
 
 # --- Function to create "padded" text ---
+@lru_cache(maxsize=LLM_CACHE_SIZE)
+def _pad_text(original_text: str, model) -> str:
+    key = _cache_key("pad", model.model_name, original_text)
+    cached = _disk_cache_get(key)
+    if cached is not None:
+        return cached
+
+    prompt = PADDING_PROMPT_TEMPLATE.format_map({"original_text": original_text})
+    response = model.generate_content(prompt)
+    contextual_sentences = response.text.strip()
+    enriched_text = f"{original_text.strip()} {contextual_sentences}"
+    _disk_cache_set(key, enriched_text)
+    return enriched_text
+
 def create_padded_text(original_text: str, model) -> str:
     """
     Takes a string of text and enriches it by adding 2-3 sentences of context.
     """
-    prompt = f"""
-    Act as a subject matter expert. Take the following text and expand upon it by adding two or three sentences of relevant context.
-    The goal is to enrich the text with related concepts, examples, or keywords to improve its connection to other content. Do not summarize it.
-
-    Original Text: "{original_text}"
-    
-    Expanded Text:
-    """
     try:
-        response = model.generate_content(prompt)
-        contextual_sentences = response.text.strip()
-        enriched_text = f"{original_text.strip()} {contextual_sentences}"
-        return enriched_text
+        return _pad_text(original_text, model)
     except Exception as e:
         print(f"An error occurred during padding: {e}")
         return original_text
 
 # --- Function to perform the initial search ---
-def search_documents(query_text: str, collection, n_results: int = 100, model_name: str = 'models/text-embedding-004'):
+@lru_cache(maxsize=LLM_CACHE_SIZE)
+def _embed_query(query_text: str, model_name: str) -> tuple:
+    key = _cache_key("embed", model_name, query_text)
+    cached = _disk_cache_get(key)
+    if cached is not None:
+        return tuple(np.frombuffer(cached, dtype=np.float32).tolist())
+
+    embedding_response = genai.embed_content(
+        model=model_name,
+        content=query_text,
+        task_type="RETRIEVAL_QUERY"
+    )
+    embedding = np.asarray(embedding_response['embedding'], dtype=np.float32)
+    _disk_cache_set(key, embedding.tobytes())
+    return tuple(embedding.tolist())
+
+def search_documents(query_text: str, collection, n_results: int = 100, model_name: str = 'models/text-embedding-004', vector_index=None, selection_text: str = None):
     """
-    Embeds a query and searches a ChromaDB collection for an initial set of candidates.
+    Embeds a query and searches for an initial set of candidates.
+    Uses the in-memory vector index when one is loaded, else queries ChromaDB.
+    With a selection_text, the results also carry "reference_distances" from
+    each chunk to that text's own embedding, as squared L2 between normalized vectors.
     """
     try:
-        embedding_response = genai.embed_content(
-            model=model_name,
-            content=query_text,
-            task_type="RETRIEVAL_QUERY"
-        )
-        query_embedding = embedding_response['embedding']
+        query_embedding = list(_embed_query(query_text, model_name))
+        selection_embedding = list(_embed_query(selection_text, model_name)) if selection_text else None
+        if vector_index is not None and len(vector_index):
+            return vector_index.query(query_embedding, n_results, reference_embedding=selection_embedding)
+        include = ["documents", "metadatas", "distances"]
+        if selection_embedding is not None:
+            include.append("embeddings")
         results = collection.query(
             query_embeddings=[query_embedding],
-            n_results=n_results
+            n_results=n_results,
+            include=include
         )
+        if selection_embedding is not None and results["ids"][0]:
+            chunk_vecs = np.asarray(results["embeddings"][0], dtype=np.float32).reshape(len(results["ids"][0]), -1)
+            chunk_vecs /= np.maximum(np.linalg.norm(chunk_vecs, axis=1, keepdims=True), 1e-12)
+            selection_vec = np.asarray(selection_embedding, dtype=np.float32)
+            selection_vec /= max(np.linalg.norm(selection_vec), 1e-12)
+            results["reference_distances"] = [(2.0 - 2.0 * (chunk_vecs @ selection_vec)).tolist()]
+            results["embeddings"] = None
         return results
     except Exception as e:
         print(f"An error occurred during the search: {e}")
         return None
 
 # --- Function to filter and validate results ---
-def filter_and_validate_results(input_text: str, search_results, model):
+# Chunks closer than VALIDATION_MIN_DISTANCE to the unpadded selection are
+# treated as the selection itself. Distances are squared L2 between normalized
+# embeddings, so 0.08 means a cosine similarity above 0.96. Surviving candidates are validated in concurrent JSON-mode
+# batches, and the remaining batches are cancelled once enough chunks are
+# accepted. The other constants bound how many candidates are sent, how
+# many share one request, how many are returned and how often a failed
+# call is retried.
+VALIDATION_MIN_DISTANCE = 0.08
+VALIDATION_MAX_CANDIDATES = 15
+VALIDATION_BATCH_SIZE = 5
+VALIDATION_MAX_RESULTS = 5
+VALIDATION_MAX_RETRIES = 3
+# JSON mode constrained to the list of {idx, helpful} verdicts the prompt asks for
+VALIDATION_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {"idx": {"type": "INTEGER"}, "helpful": {"type": "BOOLEAN"}},
+            "required": ["idx", "helpful"],
+        },
+    },
+}
+
+def _parse_verdicts(text: str) -> list:
+    """
+    Returns the verdict list from a validation reply, unwrapping a
+    single-key object such as {"results": [...]} around it.
+    """
+    verdicts = orjson.loads(text)
+    if isinstance(verdicts, dict) and len(verdicts) == 1:
+        verdicts = next(iter(verdicts.values()))
+    if not isinstance(verdicts, list):
+        raise ValueError(f"Expected a list of verdicts, got {type(verdicts).__name__}")
+    return verdicts
+
+async def _validate_candidates(input_text: str, candidate_docs: list, model) -> list:
+    """
+    Asks the LLM in a single call which candidates are helpful, retrying with
+    exponential backoff. Returns one boolean per candidate.
+    """
+    prompt = VALIDATION_PROMPT_TEMPLATE.format_map({
+        "input_text": input_text,
+        "candidates": "\n".join(f'{n}. "{doc}"' for n, doc in enumerate(candidate_docs, 1)),
+    })
+    for attempt in range(VALIDATION_MAX_RETRIES):
+        try:
+            response = await model.generate_content_async(prompt, generation_config=VALIDATION_GENERATION_CONFIG)
+            helpful = {int(item["idx"]): bool(item["helpful"]) for item in _parse_verdicts(response.text)}
+            return [helpful.get(n, False) for n in range(1, len(candidate_docs) + 1)]
+        except Exception:
+            if attempt == VALIDATION_MAX_RETRIES - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+async def filter_and_validate_results(input_text: str, search_results, model):
     """
     Filters ChromaDB results based on similarity and LLM validation.
+    The surviving candidates are validated in concurrent batched LLM calls.
     """
     relevant_chunks = {}
     if not search_results or not search_results.get('documents'):
         return relevant_chunks
 
-    for i, doc in enumerate(search_results['documents'][0]):
-        # 1. Similarity Filter
-        similarity_score = fuzz.ratio(input_text, doc)
-        if similarity_score > 80:
-            print(f"Skipping doc {i+1} (similarity: {similarity_score}%) - Too similar.")
-            continue
-
-        # 2. LLM Relevance Filter
-        prompt = f"""
-        Original Text: "{input_text}"
-        Candidate Chunk: "{doc}"
-
-        Question: Does the 'Candidate Chunk' provide new, helpful information or a different perspective that deepens the understanding of the 'Original Text'? 
-        Answer only with "yes" or "no".
-        """
-        try:
-            response = model.generate_content(prompt)
-            answer = response.text.strip().lower()
-            if "yes" in answer:
-                print(f"Adding doc {i+1} - LLM validated as helpful.")
-                metadata = search_results['metadatas'][0][i] if search_results.get('metadatas') else {}
-                relevant_chunks[f"doc_{i+1}"] = {"document":doc, "metadata": metadata}
-            else:
-                print(f"Skipping doc {i+1} - LLM flagged as not helpful.")
-        except Exception as e:
-            print(f"An error during LLM validation for doc {i+1}: {e}")
-
-        # 3. Check if we have enough results
-        if len(relevant_chunks) >= 5:
-            print("\nFound 5 relevant chunks. Breaking loop.")
-            break
-           
-    return relevant_chunks
+    # Unpack the query result once; everything below indexes these arrays
+    docs = np.asarray(search_results['documents'][0], dtype=object)
+    metas = search_results['metadatas'][0] if search_results.get('metadatas') else [{}] * len(docs)
+    # Prefer distances to the selection itself; the query distances are
+    # measured from the padded text
+    distance_key = 'reference_distances' if search_results.get('reference_distances') else 'distances'
+    if search_results.get(distance_key):
+        dists = np.asarray(search_results[distance_key][0], dtype=np.float32)
+    else:
+        dists = np.full(len(docs), np.inf, dtype=np.float32)
+
+    # 1. Similarity Filter
+    # A near-zero embedding distance means the chunk is the selection itself
+    survivors = np.flatnonzero(dists >= VALIDATION_MIN_DISTANCE)
+    if len(survivors) < len(docs):
+        print(f"Skipping {len(docs) - len(survivors)} docs - Too similar (embedding distance).")
+
+    # Coarse surface near-duplicate check, only over the head of the survivors
+    survivors = survivors[:VALIDATION_MAX_CANDIDATES * 2]
+    similarity_scores = process.cdist([input_text], docs[survivors].tolist(), scorer=fuzz.ratio, workers=-1, dtype=np.uint8)[0]
+    dissimilar = survivors[similarity_scores <= 80]
+    if len(dissimilar) < len(survivors):
+        print(f"Skipping {len(survivors) - len(dissimilar)} docs - Too similar.")
+    candidates = dissimilar[:VALIDATION_MAX_CANDIDATES].tolist()
+    if not candidates:
+        return relevant_chunks
 
+    # 2. LLM Relevance Filter
+    async def validate_batch(batch: list):
+        return batch, await _validate_candidates(input_text, docs[batch].tolist(), model)
 
+    batches = [candidates[start:start + VALIDATION_BATCH_SIZE]
+               for start in range(0, len(candidates), VALIDATION_BATCH_SIZE)]
+    tasks = [asyncio.create_task(validate_batch(batch)) for batch in batches]
+    accepted = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                batch, verdicts = await next_done
+            except Exception as e:
+                print(f"An error during LLM validation: {e}")
+                continue
+
+            for i, verdict in zip(batch, verdicts):
+                if verdict:
+                    print(f"Adding doc {i+1} - LLM validated as helpful.")
+                    accepted.append(i)
+                else:
+                    print(f"Skipping doc {i+1} - LLM flagged as not helpful.")
+
+            # 3. Check if we have enough results
+            if len(accepted) >= VALIDATION_MAX_RESULTS:
+                print(f"\nFound {VALIDATION_MAX_RESULTS} relevant chunks. Cancelling remaining validations.")
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for i in sorted(accepted)[:VALIDATION_MAX_RESULTS]:
+        relevant_chunks[f"doc_{i+1}"] = {"document": docs[i], "metadata": metas[i]}
+    return relevant_chunks
 
-import os
-import json
 
 def save_results_to_file(extracted_text: str, search_results: dict, filename: str = 'results.jsonl'):
     """
@@ -111,31 +302,21 @@ def save_results_to_file(extracted_text: str, search_results: dict, filename: st
         search_results: The dictionary returned by a ChromaDB query.
         filename: The name of the file to save.
     """
-    # 1. Check if the file exists and delete it to ensure a fresh start
-    if os.path.exists(filename):
-        os.remove(filename)
-        print(f"Deleted existing file: {filename}")
-
-    # 2. Write the new file
-    with open(filename, 'w') as f:
-        # --- THIS IS THE NEW LOGIC ---
-        # First, write the extracted_text as the first line
-        header_record = {"original_query": extracted_text}
-        json.dump(header_record, f)
-        f.write('\n') # Add a newline to separate it from the results
-
-        # Next, write each search result on a new line
-        if search_results and search_results.get('documents'):
-            num_docs = len(search_results['documents'][0])
-            for i in range(num_docs):
-                record = {
-                    "document": search_results['documents'][0][i],
-                    "distance": search_results['distances'][0][i],
-                    "metadata": search_results['metadatas'][0][i] if search_results.get('metadatas') else {}
-                }
-                json.dump(record, f)
-                f.write('\n') # Add a newline for the next object
-        # --- END OF NEW LOGIC ---
+    # Serialize every record up front so the file is written in one go
+    lines = [orjson.dumps({"original_query": extracted_text})]
+    if search_results and search_results.get('documents'):
+        docs = search_results['documents'][0]
+        dists = search_results['distances'][0]
+        metas = search_results['metadatas'][0] if search_results.get('metadatas') else [{}] * len(docs)
+        lines.extend(
+            orjson.dumps({"document": doc, "distance": dist, "metadata": meta}, option=orjson.OPT_SERIALIZE_NUMPY)
+            for doc, dist, meta in zip(docs, dists, metas)
+        )
+    lines.append(b"")
+
+    # 'wb' truncates any existing file, so no separate delete is needed
+    with open(filename, 'wb', buffering=1024 * 1024) as f:
+        f.write(b"\n".join(lines))
 
     print(f"✅ Successfully saved query and results to {filename}")
 
@@ -194,7 +375,7 @@ if __name__ == "__main__":
     initial_results = search_documents(padded_text, collection, n_results=15)
 
     print("\n--- Step 3: Filtering and validating results ---")
-    final_chunks = filter_and_validate_results(input_text, initial_results, gemini_pro_model)
+    final_chunks = asyncio.run(filter_and_validate_results(input_text, initial_results, gemini_pro_model))
 
     # --- 4. Display the Final, Validated Results ---
     print("\n--- Final Validated Results ---")
@@ -1,25 +1,36 @@
 import fitz  # PyMuPDF
 import json
-import re
+import numpy as np
 import chromadb
 import google.generativeai as genai
 import os
+from bisect import bisect_right
+from collections import defaultdict
 
 # --- Helper functions are kept internal to this module ---
 
-def _extract_blocks(pdf: fitz.Document) -> list:
-    """Helper function to extract all text blocks from a PDF."""
+def _normalize_text(text: str) -> str:
+    """Lowercases text and collapses whitespace for heading matching."""
+    return " ".join(text.lower().split())
+
+def _extract_blocks(pdf: fitz.Document) -> tuple:
+    """
+    Helper function to extract all text blocks from a PDF, along with an index
+    mapping (page_num, normalized first line) to the first matching block.
+    """
     all_blocks = []
+    text_to_block = {}
     for page_num, page in enumerate(pdf):
         for block in page.get_text("blocks"):
+            text_to_block.setdefault((page_num, _normalize_text(block[4].split("\n", 1)[0])), len(all_blocks))
             all_blocks.append({
                 "page_num": page_num,
                 "bbox": [round(c, 2) for c in block[:4]],
                 "text": block[4]
             })
-    return all_blocks
+    return all_blocks, text_to_block
 
-def _create_chunks(pdf: fitz.Document, all_blocks: list, outline: list) -> list:
+def _create_chunks(pdf: fitz.Document, all_blocks: list, text_to_block: dict, outline: list) -> list:
     """Helper function to create precisely chunked content based on H1 headings."""
     h1_items = [item for item in outline if item.get("level") in ["H1"]]
     
@@ -34,22 +45,46 @@ def _create_chunks(pdf: fitz.Document, all_blocks: list, outline: list) -> list:
             "chunk_bboxes": all_bboxes
         }]
 
+    # Index the blocks of each page, sorted by their top y-coordinate
+    page_blocks = defaultdict(list)
+    for i, block in enumerate(all_blocks):
+        page_blocks[block['page_num']].append((block['bbox'][1], i, block['bbox']))
+    page_tops = {}
+    for page_num, entries in page_blocks.items():
+        entries.sort(key=lambda entry: entry[0])
+        page_tops[page_num] = [entry[0] for entry in entries]
+
     # Find the precise location of each H1 heading
     h1_positions = []
     for h1 in h1_items:
         h1_text = h1['text'].strip()
         page_num_for_h1 = h1.get('page', 0)
-        search_results = pdf[page_num_for_h1].search_for(h1_text)
-        if not search_results: continue
-
-        heading_rect = search_results[0]
-        for i, block in enumerate(all_blocks):
-            if block['page_num'] == page_num_for_h1 and fitz.Rect(block['bbox']).contains(heading_rect):
-                h1_positions.append({
-                    "text": h1_text, "page_num": page_num_for_h1,
-                    "block_index": i, "block_text": block['text']
-                })
-                break
+        h1_key = _normalize_text(h1_text)
+        if not h1_key: continue
+
+        # Most headings open their own block, so try the block index first
+        block_index = text_to_block.get((page_num_for_h1, h1_key))
+        if block_index is None:
+            matches = [i for _, i, _ in page_blocks[page_num_for_h1]
+                       if _normalize_text(all_blocks[i]['text']).startswith(h1_key)]
+            block_index = min(matches) if matches else None
+        if block_index is None:
+            # Fall back to locating the heading on the page itself
+            search_results = pdf[page_num_for_h1].search_for(h1_text)
+            if not search_results: continue
+
+            hx0, hy0, hx1, hy1 = search_results[0]
+            # Only blocks starting at or above the heading can contain it
+            end = bisect_right(page_tops.get(page_num_for_h1, []), hy0)
+            containing = [i for _, i, (bx0, by0, bx1, by1) in page_blocks[page_num_for_h1][:end]
+                          if bx0 <= hx0 <= hx1 <= bx1 and by0 <= hy0 <= hy1 <= by1]
+            if not containing: continue
+            block_index = min(containing)
+
+        h1_positions.append({
+            "text": h1_text, "page_num": page_num_for_h1,
+            "block_index": block_index, "block_text": all_blocks[block_index]['text']
+        })
     
     h1_positions.sort(key=lambda x: x['block_index'])
     
@@ -69,10 +104,10 @@ def _create_chunks(pdf: fitz.Document, all_blocks: list, outline: list) -> list:
         except ValueError:
             first_block_content = current_h1['block_text']
 
-        remaining_blocks = all_blocks[start_block_idx + 1 : end_block_idx]
-        remaining_content = " ".join([block['text'].strip() for block in remaining_blocks])
-        
-        full_content = re.sub(r'\s+', ' ', (first_block_content.strip() + " " + remaining_content).strip())
+        # str.split() collapses every whitespace run, so no regex pass is needed
+        parts = [first_block_content]
+        parts.extend(block['text'] for block in all_blocks[start_block_idx + 1 : end_block_idx])
+        full_content = " ".join(word for part in parts for word in part.split())
         
         start_page = current_h1['page_num']
         end_page = all_blocks[end_block_idx - 1]['page_num'] if end_block_idx > start_block_idx else start_page
@@ -88,55 +123,79 @@ def _create_chunks(pdf: fitz.Document, all_blocks: list, outline: list) -> list:
 
 # --- Main public function ---
 
-def process_and_embed(pdf_path: str, data_variable: dict, db_collection):
+# Gemini accepts at most 100 texts per embed request; ChromaDB inserts are
+# fastest in moderately sized batches.
+EMBED_BATCH_SIZE = 100
+DB_ADD_BATCH_SIZE = 200
+
+def process_and_embed(pdf_items: list, db_collection):
     """
-    Processes a single PDF, embeds its chunks using the Gemini API,
+    Processes a batch of PDFs, embeds all of their chunks using the Gemini API,
     and stores them in the provided ChromaDB collection.
     
     Args:
-        pdf_path: The file path to the PDF.
-        data_variable: A dictionary containing metadata like the outline.
+        pdf_items: A list of (pdf_path, data_variable) tuples, where pdf_path is
+            the file path to the PDF and data_variable is a dictionary
+            containing metadata like the outline.
         db_collection: The initialized ChromaDB collection object from the main app.
+
+    Returns:
+        An (ids, documents, metadatas, embeddings) tuple of the added chunks,
+        or None if nothing was added.
     """
     if not db_collection:
         print("Error: ChromaDB collection was not provided.")
-        return
+        return None
 
-    print(f"\n--- Processing file: {os.path.basename(pdf_path)} ---")
-    pdf_filename = data_variable.get('filename', os.path.basename(pdf_path))
-    outline = data_variable.get('outline', [])
-    
-    try:
-        with fitz.open(pdf_path) as pdf:
-            all_blocks = _extract_blocks(pdf)
-            initial_chunks = _create_chunks(pdf, all_blocks, outline)
-    except Exception as e:
-        print(f"Error processing PDF file at {pdf_path}: {e}")
-        return
-
-    if not initial_chunks:
-        print("No chunks were created. Nothing to add to the database.")
-        return
+    texts_to_embed, metadatas, ids = [], [], []
+    for pdf_path, data_variable in pdf_items:
+        print(f"\n--- Processing file: {os.path.basename(pdf_path)} ---")
+        pdf_filename = data_variable.get('filename', os.path.basename(pdf_path))
+        outline = data_variable.get('outline', [])
+        
+        try:
+            with fitz.open(pdf_path) as pdf:
+                all_blocks, text_to_block = _extract_blocks(pdf)
+                initial_chunks = _create_chunks(pdf, all_blocks, text_to_block, outline)
+        except Exception as e:
+            print(f"Error processing PDF file at {pdf_path}: {e}")
+            continue
 
-    texts_to_embed = [chunk['content'] for chunk in initial_chunks]
+        if not initial_chunks:
+            print(f"No chunks were created for '{pdf_filename}'.")
+            continue
+
+        texts_to_embed.extend(chunk['content'] for chunk in initial_chunks)
+        metadatas.extend({
+            'document': pdf_filename, 
+            'section_title': chunk['section_title'], 
+            'page_range': str(chunk['page_range']),
+            'chunk_bboxes': str(chunk['chunk_bboxes'])
+        } for chunk in initial_chunks)
+        ids.extend(f"{pdf_filename}_chunk_{i}" for i in range(len(initial_chunks)))
+
+    if not texts_to_embed:
+        print("No chunks were created. Nothing to add to the database.")
+        return None
     
     print(f"Embedding {len(texts_to_embed)} chunks with Gemini...")
-    result = genai.embed_content(
-        model="models/text-embedding-004",
-        content=texts_to_embed,
-        task_type="RETRIEVAL_DOCUMENT"
-    )
-    embeddings = result['embedding']
-    
-    metadatas = [{
-        'document': pdf_filename, 
-        'section_title': chunk['section_title'], 
-        'page_range': str(chunk['page_range']),
-        'chunk_bboxes': str(chunk['chunk_bboxes'])
-    } for chunk in initial_chunks]
-    ids = [f"{pdf_filename}_chunk_{i}" for i in range(len(initial_chunks))]
-
-    db_collection.add(documents=texts_to_embed, metadatas=metadatas, ids=ids, embeddings=embeddings)
+    embeddings = []
+    for start in range(0, len(texts_to_embed), EMBED_BATCH_SIZE):
+        result = genai.embed_content(
+            model="models/text-embedding-004",
+            content=texts_to_embed[start:start + EMBED_BATCH_SIZE],
+            task_type="RETRIEVAL_DOCUMENT"
+        )
+        embeddings.extend(result['embedding'])
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    for start in range(0, len(ids), DB_ADD_BATCH_SIZE):
+        end = start + DB_ADD_BATCH_SIZE
+        db_collection.add(
+            documents=texts_to_embed[start:end], metadatas=metadatas[start:end],
+            ids=ids[start:end], embeddings=embeddings[start:end]
+        )
     
-    print(f"✅ Successfully added {len(ids)} chunks for '{pdf_filename}'.")
-    print(f"Database now contains {db_collection.count()} total chunks.")
\ No newline at end of file
+    print(f"✅ Successfully added {len(ids)} chunks from {len(pdf_items)} file(s).")
+    print(f"Database now contains {db_collection.count()} total chunks.")
+    return ids, texts_to_embed, metadatas, embeddings
\ No newline at end of file
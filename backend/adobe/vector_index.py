@@ -0,0 +1,109 @@
+import numpy as np
+
+# Number of int8 rows dequantized per matrix product during a query
+QUERY_BLOCK_ROWS = 4096
+
+
+class VectorIndex:
+    """
+    In-memory inner-product index over the chunks stored in ChromaDB.
+    ChromaDB stays the persistent store; this serves the query hot path.
+    Embeddings are scalar-quantized to int8 with one scale per dimension,
+    a quarter of the float32 footprint.
+    """
+
+    def __init__(self, ids: list, documents: list, metadatas: list, embeddings):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = [metadata or {} for metadata in metadatas]
+        if self.ids:
+            embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(self.ids), -1)
+        else:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        embeddings = self._normalize(embeddings)
+
+        self.scales = np.abs(embeddings).max(axis=0, initial=0.0) / 127.0
+        self.scales[self.scales == 0] = 1.0
+        self.codes = np.rint(embeddings / self.scales).astype(np.int8)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def from_collection(cls, collection):
+        """
+        Loads every chunk of a ChromaDB collection into a new index.
+        """
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        index = cls(data["ids"], data["documents"], data["metadatas"], data["embeddings"])
+        print(f"Vector index loaded with {len(index)} chunks.")
+        return index
+
+    def extended(self, ids: list, documents: list, metadatas: list, embeddings) -> "VectorIndex":
+        """
+        Returns a new index with the given chunks appended, leaving this one
+        untouched for queries already running against it.
+        Existing codes are only rescaled when a new vector exceeds a dimension's scale.
+        """
+        if not len(self):
+            return VectorIndex(ids, documents, metadatas, embeddings)
+        if not ids:
+            return self
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        embeddings = self._normalize(embeddings)
+
+        scales = np.maximum(self.scales, np.abs(embeddings).max(axis=0) / 127.0)
+        codes = self.codes
+        if np.any(scales > self.scales):
+            codes = np.rint(codes * (self.scales / scales)).astype(np.int8)
+
+        index = VectorIndex.__new__(VectorIndex)
+        index.ids = self.ids + list(ids)
+        index.documents = self.documents + list(documents)
+        index.metadatas = self.metadatas + [metadata or {} for metadata in metadatas]
+        index.scales = scales
+        index.codes = np.concatenate([codes, np.rint(embeddings / scales).astype(np.int8)])
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _scaled(self, embedding) -> np.ndarray:
+        # Fold the per-dimension scales into the query so codes are used as-is
+        vector = self._normalize(np.asarray(embedding, dtype=np.float32).ravel())
+        return (vector * self.scales).astype(np.float32)
+
+    def query(self, query_embedding, n_results: int = 100, reference_embedding=None) -> dict:
+        """
+        Returns the n_results nearest chunks in the same shape as collection.query.
+        Distances are squared L2 between normalized vectors, i.e. 2 - 2 * cosine.
+        With a reference_embedding, "reference_distances" holds each returned
+        chunk's distance to it on the same scale.
+        """
+        if not len(self):
+            empty = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+            if reference_embedding is not None:
+                empty["reference_distances"] = [[]]
+            return empty
+        scaled_query = self._scaled(query_embedding)
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), QUERY_BLOCK_ROWS):
+            block = self.codes[start:start + QUERY_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+
+        k = min(n_results, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(k)
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results = {
+            "ids": [[self.ids[i] for i in top]],
+            "documents": [[self.documents[i] for i in top]],
+            "metadatas": [[self.metadatas[i] for i in top]],
+            "distances": [(2.0 - 2.0 * scores[top]).tolist()],
+        }
+        if reference_embedding is not None:
+            reference_scores = self.codes[top].astype(np.float32) @ self._scaled(reference_embedding)
+            results["reference_distances"] = [(2.0 - 2.0 * reference_scores).tolist()]
+        return results
@@ -1,8 +1,4 @@
-import json
-import os
-import google.generativeai as genai
-
-import json
+import orjson
 import os
 import google.generativeai as genai
 
@@ -12,18 +8,19 @@ def generate_insights_from_file(jsonl_filepath: str, model):
     generates an insight, and returns it as a string.
     """
     try:
-        with open(jsonl_filepath, 'r') as f:
-            # 1. Read the first line to get the original query
-            first_line = f.readline()
-            if not first_line:
-                print("Error: The results file is empty.")
-                return None
-            selected_text = json.loads(first_line)['original_query']
-            
-            # 2. Read the rest of the lines for the search results
-            retrieved_chunks = [json.loads(line) for line in f]
+        with open(jsonl_filepath, 'rb') as f:
+            lines = f.read().splitlines()
+
+        # 1. The first line holds the original query
+        if not lines:
+            print("Error: The results file is empty.")
+            return None
+        selected_text = orjson.loads(lines[0])['original_query']
+
+        # 2. The rest of the lines are the search results
+        retrieved_chunks = [orjson.loads(line) for line in lines[1:]]
             
-    except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
+    except (FileNotFoundError, orjson.JSONDecodeError, KeyError) as e:
         print(f"Error reading or parsing '{jsonl_filepath}': {e}")
         return None # Return None on error
 
@@ -1,6 +1,8 @@
 import os
 import io
 import json
+import asyncio
+import aiofiles
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request , Form
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List
@@ -11,11 +13,12 @@ from PIL import Image
 import google.generativeai as genai
 import chromadb
 from chromadb.config import Settings
-from podcast import generate_podcast_script
+from podcast import generate_podcast_script, stream_podcast_script
 
 # --- Import your actual, functional modules ---
 from a1 import process_single_pdf
 from adobe.main import process_and_embed
+from adobe.vector_index import VectorIndex
 from adobe.llm import create_padded_text, search_documents, save_results_to_file, filter_and_validate_results
 from bulb import generate_insights_from_file
 # --- 1. Configuration ---
@@ -37,6 +40,21 @@ DB_NAME = os.getenv("DB_NAME", "mydb")
 RESULTS_FILE_PATH = os.path.join(os.path.dirname(__file__), "results.jsonl")
 BULB_FILE_PATH = os.path.join(os.path.dirname(__file__), "bulb.jsonl")
 
+# Maximum number of uploaded PDFs parsed at the same time
+UPLOAD_CONCURRENCY = 4
+
+# Bytes read from a screenshot to check its image signature
+IMAGE_CHUNK_SIZE = 64 * 1024
+# Screenshots below this size are the frontend's 1x1 placeholder images
+MOCK_SCREENSHOT_MAX_BYTES = 1000
+# Leading bytes of the image formats accepted for screenshots
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # --- 2. FastAPI App Initialization ---
@@ -57,34 +75,73 @@ async def startup_event():
     app.state.mongo_client = AsyncIOMotorClient(MONGO_URI)
     app.state.db = app.state.mongo_client[DB_NAME]
     
+    # One shared model serves every endpoint, so its gRPC channel (and the
+    # HTTP/2 connection under it) is reused across requests.
     genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    app.state.vision_model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    app.state.pro_model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    app.state.gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
     
     chroma_client = chromadb.Client(Settings(is_persistent=True, persist_directory=CHROMA_DB_PATH))
     app.state.collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+    app.state.vector_index = VectorIndex.from_collection(app.state.collection)
+    # Serializes updates so concurrent uploads each extend the latest index
+    app.state.vector_index_lock = asyncio.Lock()
     print("All clients and models initialized successfully.")
 
+# --- Screenshot helpers ---
+def _sniff_image_type(header: bytes):
+    """
+    Returns the MIME type of an image from its magic bytes, or None if unknown.
+    """
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def _generate_from_image(model, prompt: str, image_bytes: bytes, mime_type: str):
+    """
+    Sends a prompt together with an inline image to a Gemini model.
+    """
+    return model.generate_content([prompt, {"mime_type": mime_type, "data": image_bytes}])
+
 # --- 4. API Endpoints ---
 @app.post("/upload_pdfs")
 async def upload_pdfs(request: Request, files: List[UploadFile] = File(...)):
     # ... (Your existing upload logic)
     db = request.app.state.db
     collection = request.app.state.collection
-    saved_files = []
-    for file in files:
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-
-        data = await run_in_threadpool(process_single_pdf, file_path)
-        await run_in_threadpool(process_and_embed, file_path, data, collection)
-        
-        await db["pdfs"].insert_one({
-            "filename": file.filename,
-            "path": file_path
-        })
-        saved_files.append(file.filename)
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    # Files are written concurrently, so two files with the same name would
+    # write to the same path at once; reject the upload instead
+    file_paths = [os.path.join(UPLOAD_FOLDER, file.filename) for file in files]
+    duplicates = sorted({os.path.basename(path) for path in file_paths if file_paths.count(path) > 1})
+    if duplicates:
+        raise HTTPException(status_code=400, detail=f"Duplicate file names in upload: {', '.join(duplicates)}")
+
+    async def ingest_one(file: UploadFile, file_path: str):
+        async with semaphore:
+            async with aiofiles.open(file_path, "wb") as f:
+                await f.write(await file.read())
+            data = await run_in_threadpool(process_single_pdf, file_path)
+        return file_path, data
+
+    pdf_items = await asyncio.gather(*[ingest_one(f, path) for f, path in zip(files, file_paths)])
+    saved_files = [file.filename for file in files]
+
+    # Embed and store the chunks of all uploaded PDFs in one batched pass
+    added = await run_in_threadpool(process_and_embed, list(pdf_items), collection)
+    if added:
+        async with request.app.state.vector_index_lock:
+            request.app.state.vector_index = await run_in_threadpool(
+                request.app.state.vector_index.extended, *added
+            )
+
+    await db["pdfs"].insert_many([{
+        "filename": os.path.basename(file_path),
+        "path": file_path
+    } for file_path, _ in pdf_items])
     return {"message": f"{len(saved_files)} PDFs uploaded.", "files": saved_files}
 
 # In main.py
@@ -103,7 +160,7 @@ async def list_pdfs(request: Request):
     return {"pdfs": [pdf['filename'] for pdf in pdf_list]}
 
 
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 # --- CORRECTED ENDPOINT to fetch a PDF ---
 @app.get("/get_pdf/{filename}")
@@ -133,22 +190,28 @@ async def extract_and_search(
     image: UploadFile = File(...),
     text: str = Form(...)  # <-- ADDED: Accept text from the frontend
 ):
-    vision_model = request.app.state.vision_model
-    pro_model = request.app.state.pro_model
+    model = request.app.state.gemini_model
     collection = request.app.state.collection
 
-    if not all([vision_model, pro_model, collection]):
+    if not all([model, collection]):
         raise HTTPException(status_code=503, detail="Backend services unavailable.")
 
-    if not image.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File is not an image.")
+    # Check if this is a mock screenshot (very small image) or real screenshot
+    # from the upload metadata, so mock screenshots are never read at all
+    image_size = image.size
+    if image_size is None and image.headers.get("content-length", "").isdigit():
+        image_size = int(image.headers["content-length"])
+
+    if image_size is None or image_size >= MOCK_SCREENSHOT_MAX_BYTES:
+        first_chunk = await image.read(IMAGE_CHUNK_SIZE)
+        mime_type = _sniff_image_type(first_chunk)
+        if mime_type is None:
+            raise HTTPException(status_code=400, detail="File is not an image.")
+        if image_size is None:
+            image_size = len(first_chunk)
 
     try:
-        contents = await image.read()
-        image_part = {"mime_type": image.content_type, "data": contents}
-        
-        # Check if this is a mock screenshot (very small image) or real screenshot
-        if len(contents) < 1000:  # Mock screenshot is very small
+        if image_size < MOCK_SCREENSHOT_MAX_BYTES:  # Mock screenshot is very small
             print("📋 Mock screenshot detected, using text-based analysis")
             # For mock screenshots, just use the provided text directly
             extracted_text = text.strip()
@@ -183,19 +246,28 @@ async def extract_and_search(
                 Provided Text: "{text}"
                 """
             
+            # The upload is already spooled by Starlette; the image goes to
+            # the model inline, so read the rest of it straight into memory
+            image_bytes = first_chunk + await image.read()
+
             # Send the new prompt and the image to the model
-            response = vision_model.generate_content([extraction_prompt, image_part])
+            response = await run_in_threadpool(
+                _generate_from_image, model, extraction_prompt, image_bytes, mime_type
+            )
             extracted_text = response.text.strip()
 
         # The rest of the workflow remains the same
-        padded_text = await run_in_threadpool(create_padded_text, extracted_text, pro_model)
-        search_results = await run_in_threadpool(search_documents, padded_text, collection)
+        padded_text = await run_in_threadpool(create_padded_text, extracted_text, model)
+        search_results = await run_in_threadpool(
+            search_documents, padded_text, collection,
+            vector_index=request.app.state.vector_index, selection_text=extracted_text
+        )
 
         if not search_results:
             raise HTTPException(status_code=404, detail="No relevant documents found.")
 
         # Filter and get the best 3 relevant results
-        filtered_results = await run_in_threadpool(filter_and_validate_results, extracted_text, search_results, pro_model)
+        filtered_results = await filter_and_validate_results(extracted_text, search_results, model)
         
         if not filtered_results:
             raise HTTPException(status_code=404, detail="No relevant filtered documents found.")
@@ -227,7 +299,7 @@ async def generate_insights(request: Request):
     """
     Generates insights from available context or provides default insights.
     """
-    pro_model = request.app.state.pro_model
+    model = request.app.state.gemini_model
 
     try:
         if os.path.exists(RESULTS_FILE_PATH):
@@ -235,7 +307,7 @@ async def generate_insights(request: Request):
             insight_text = await run_in_threadpool(
                 generate_insights_from_file, 
                 RESULTS_FILE_PATH, 
-                pro_model
+                model
             )
         else:
             # Generate default insights if no search results available
@@ -244,7 +316,7 @@ async def generate_insights(request: Request):
             Provide practical tips on how to effectively analyze documents and find relevant information.
             Keep it concise and actionable.
             """
-            response = pro_model.generate_content(default_prompt)
+            response = model.generate_content(default_prompt)
             insight_text = response.text.strip()
 
         if not insight_text:
@@ -270,20 +342,15 @@ async def generate_podcast(request: Request):
     Reads the results and bulb files, generates a podcast script,
     and returns it to the frontend.
     """
-    pro_model = request.app.state.pro_model
+    model = request.app.state.gemini_model
 
     # Check if the necessary files exist
     if not os.path.exists(RESULTS_FILE_PATH) or not os.path.exists(BULB_FILE_PATH):
         raise HTTPException(status_code=404, detail="Required result and insight files not found. Please complete the previous steps first.")
 
     try:
-        # Generate the podcast script in a thread pool
-        podcast_script = await run_in_threadpool(
-            generate_podcast_script,
-            RESULTS_FILE_PATH,
-            BULB_FILE_PATH,
-            pro_model
-        )
+        # Generate the podcast script without blocking the event loop
+        podcast_script = await generate_podcast_script(RESULTS_FILE_PATH, BULB_FILE_PATH, model)
 
         if not podcast_script:
             raise HTTPException(status_code=500, detail="LLM failed to generate a valid podcast script.")
@@ -294,6 +361,38 @@ async def generate_podcast(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate podcast script: {str(e)}")
 
+@app.get("/generate_podcast/stream")
+async def stream_podcast(request: Request):
+    """
+    Streams the podcast script to the frontend as plain text while Gemini
+    generates it, so the first lines arrive before the script is finished.
+    """
+    model = request.app.state.gemini_model
+
+    if not os.path.exists(RESULTS_FILE_PATH) or not os.path.exists(BULB_FILE_PATH):
+        raise HTTPException(status_code=404, detail="Required result and insight files not found. Please complete the previous steps first.")
+
+    # Wait for the first piece before responding, so failures up to that
+    # point still reach the client as an HTTP error
+    pieces = stream_podcast_script(RESULTS_FILE_PATH, BULB_FILE_PATH, model)
+    try:
+        first_piece = await anext(pieces)
+    except StopAsyncIteration:
+        raise HTTPException(status_code=500, detail="LLM failed to generate a valid podcast script.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate podcast script: {str(e)}")
+
+    async def script_stream():
+        yield first_piece
+        try:
+            async for piece in pieces:
+                yield piece
+        except Exception as e:
+            # The status line is already sent, so the error can only end the stream
+            print(f"Podcast stream interrupted: {e}")
+
+    return StreamingResponse(script_stream(), media_type="text/plain; charset=utf-8")
+
 
 
 
@@ -1,64 +1,505 @@
-import json
+import asyncio
+import aiofiles
+import mmap
+import orjson
 import os
+import re
+import sqlite3
+import string
+import tempfile
+import threading
+from functools import lru_cache
+import numpy as np
 import google.generativeai as genai
 from dotenv import load_dotenv
 
-def generate_podcast_script(results_filepath: str, bulb_filepath: str, model):
+# bulb.jsonl is read in binary mode through a buffer of this size
+READ_BUFFER_SIZE = 64 * 1024
+
+# Leading "document" and "distance" fields of a results.jsonl record, in the
+# order save_results_to_file writes them
+RESULT_LINE_PATTERN = re.compile(
+    rb'\{\s*"document"\s*:\s*"((?:[^"\\]|\\.)*)"\s*,\s*"distance"\s*:\s*(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*[,}]'
+)
+
+# Static scriptwriter instructions. They never change between requests, so
+# they are built once and always lead the prompt, ahead of the dynamic
+# context. An identical prefix is what Gemini's prefix caching keys on.
+PODCAST_INSTRUCTIONS = """
+You are a creative podcast scriptwriter. Your task is to create an engaging and informative podcast script for two speakers: Alex (the curious Host) and Ben (the knowledgeable Expert).
+
+Use the following information to write the script:
+- The **[Original Topic]** is the user's initial point of interest.
+- The **[Retrieved Information]** contains relevant text chunks from the user's document library.
+- The **[Key Insight]** is a high-level analysis that connects these chunks.
+
+**Instructions:**
+1.  **Structure:** Create a podcast script with a reading time between 2 and 5 minutes (approximately 300-750 words).
+2.  **Roles:**
+    -   **Alex (Host):** Should ask questions based on the [Original Topic].
+    -   **Ben (Expert):** Should answer by synthesizing information from the [Retrieved Information] and the [Key Insight], making comparisons and explaining connections.
+3.  **Tone:** Make the conversation natural, engaging, and easy for a general audience to understand.
+"""
+
+# Model used when the caller does not pass one in
+PODCAST_MODEL_NAME = "gemini-1.5-flash"
+
+# Decode settings shared by every podcast call; the token cap sits just
+# above the 750-word upper target (~1.5 tokens per word, about 1125 tokens)
+PODCAST_GENERATION_CONFIG = {"max_output_tokens": 1200, "temperature": 0.7, "top_p": 0.9}
+
+@lru_cache(maxsize=1)
+def get_model(model_name: str = PODCAST_MODEL_NAME):
     """
-    Reads context from results and bulb files to generate a two-speaker podcast script.
+    Returns a shared GenerativeModel, created on first use.
+    """
+    return genai.GenerativeModel(model_name)
+
+# Full prompt: the static instructions followed by the per-request context,
+# compiled once and filled in with Template.substitute
+PODCAST_PROMPT_TEMPLATE = string.Template(PODCAST_INSTRUCTIONS + """
+---
+**[Original Topic]:**
+"$original_query"
+
+**[Retrieved Information]:**
+$formatted_chunks
+
+**[Key Insight]:**
+"$bulb_insight"
+---
+
+**Podcast Script:**
+""")
+
+# Returned without calling Gemini when there are no retrieved chunks or no insight
+FALLBACK_SCRIPT = (
+    "Alex: Today we wanted to dig into your topic, but there isn't enough material yet.\n"
+    "Ben: Right. Once there are related passages in your library and an insight connecting them, "
+    "we'll have plenty to talk about."
+)
+
+# Upper bound on the estimated prompt size, and the part of it taken by the
+# template itself; retrieved chunks only get what is left
+PROMPT_TOKEN_BUDGET = 8000
+STATIC_PROMPT_TOKENS = len(PODCAST_PROMPT_TEMPLATE.template) // 4
+
+# --- Semantic cache of generated scripts ---
+# A new (query, insight) pair whose embedding is at least this cosine-similar
+# to a cached cluster's prompt centroid is a candidate hit.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+# A candidate hit is only served when the pair is also at least this similar
+# to the cluster's response centroid, i.e. the cached script is about it.
+SCRIPT_RELEVANCE_THRESHOLD = 0.5
+# A new script only joins a cluster when it is at least this similar to the
+# scripts already there; otherwise it starts a cluster of its own.
+RESPONSE_CLUSTER_THRESHOLD = 0.85
+CACHE_EMBEDDING_MODEL = "models/text-embedding-004"
+# Clusters kept in memory and on disk; past this the oldest one is replaced
+SEMANTIC_CACHE_MAX_CLUSTERS = 1024
+# SQLite file the clusters are persisted to, so cached scripts survive
+# restarts. It lives in a cache directory outside the source tree.
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "aih_finale_cache"))
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", os.path.join(CACHE_DIR, "podcast_cache.sqlite3"))
+
+class SemanticScriptCache:
+    """
+    Cache of podcast scripts keyed by the embedding of the (original query,
+    insight) pair they were generated from. Each cluster keeps a prompt
+    centroid and a response centroid, the running means of its members'
+    pair and script embeddings.
+
+    Centroids live in two preallocated matrices with one row per cluster, so
+    lookups are a single matrix product and adds update one row in place.
+    At most max_clusters clusters are kept; once full, a new cluster replaces
+    the oldest one. When a path is given every change is also written to
+    SQLite and the newest clusters are loaded back from it on first use.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 relevance_threshold: float = SCRIPT_RELEVANCE_THRESHOLD,
+                 response_threshold: float = RESPONSE_CLUSTER_THRESHOLD,
+                 max_clusters: int = SEMANTIC_CACHE_MAX_CLUSTERS,
+                 path: str = None):
+        self.threshold = threshold
+        self.relevance_threshold = relevance_threshold
+        self.response_threshold = response_threshold
+        self.max_clusters = max_clusters
+        self.path = path
+        # Rows [0, size) of the matrices are in use; per-row bookkeeping below
+        self._prompt_matrix = None
+        self._response_matrix = None
+        self.size = 0
+        self.cluster_ids = []
+        self.counts = []
+        self.scripts = []
+        # Row the next new cluster goes to; cycles through the rows once full,
+        # which always lands on the oldest cluster
+        self._next_row = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._loaded = not path
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use and shared afterwards; callers hold self._lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS clusters (cluster_id INTEGER PRIMARY KEY, "
+                "prompt_centroid BLOB, response_centroid BLOB, count INTEGER, script TEXT)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            rows = self._connection().execute(
+                "SELECT cluster_id, prompt_centroid, response_centroid, count, script "
+                "FROM clusters ORDER BY cluster_id DESC LIMIT ?",
+                (self.max_clusters,),
+            ).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not load the podcast script cache: {e}")
+            return
+        # Oldest first, so the row cycle starts at the oldest cluster
+        for cluster_id, prompt_centroid, response_centroid, count, script in reversed(rows):
+            self._store_row(
+                cluster_id,
+                np.frombuffer(prompt_centroid, dtype=np.float32),
+                np.frombuffer(response_centroid, dtype=np.float32),
+                count, script,
+            )
+            self._next_id = cluster_id + 1
+        if rows:
+            print(f"Podcast script cache loaded with {len(rows)} clusters.")
+            # Rows beyond the cap (e.g. after lowering it) are not kept
+            self._execute("DELETE FROM clusters WHERE cluster_id < ?", (self.cluster_ids[self._oldest_row()],))
+
+    def _oldest_row(self) -> int:
+        return self._next_row if self.size == self.max_clusters else 0
+
+    def _execute(self, sql: str, params: tuple):
+        if not self.path:
+            return
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(sql, params)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not write to the podcast script cache: {e}")
+
+    def _persist(self, row: int):
+        self._execute(
+            "INSERT OR REPLACE INTO clusters (cluster_id, prompt_centroid, response_centroid, count, script) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self.cluster_ids[row], self._prompt_matrix[row].tobytes(), self._response_matrix[row].tobytes(),
+             self.counts[row], self.scripts[row]),
+        )
+
+    def _store_row(self, cluster_id: int, embedding: np.ndarray, response_embedding: np.ndarray, count: int, script: str):
+        """
+        Writes a cluster to the next row, replacing the oldest one when full.
+        Returns the row and the id of the replaced cluster, if any.
+        """
+        if self._prompt_matrix is None:
+            self._prompt_matrix = np.empty((self.max_clusters, len(embedding)), dtype=np.float32)
+            self._response_matrix = np.empty((self.max_clusters, len(response_embedding)), dtype=np.float32)
+        row = self._next_row
+        self._next_row = (row + 1) % self.max_clusters
+        self._prompt_matrix[row] = embedding
+        self._response_matrix[row] = response_embedding
+        if row < self.size:
+            evicted_id = self.cluster_ids[row]
+            self.cluster_ids[row], self.counts[row], self.scripts[row] = cluster_id, count, script
+            return row, evicted_id
+        self.cluster_ids.append(cluster_id)
+        self.counts.append(count)
+        self.scripts.append(script)
+        self.size += 1
+        return row, None
+
+    def _nearest(self, embedding: np.ndarray, response_embedding: np.ndarray, response_threshold: float):
+        """
+        Returns the row of the cluster most similar to the embedding among
+        those whose prompt and response centroids both pass their thresholds.
+        """
+        if not self.size:
+            return None
+        prompt_similarities = self._prompt_matrix[:self.size] @ embedding
+        response_similarities = self._response_matrix[:self.size] @ response_embedding
+        passing = (prompt_similarities >= self.threshold) & (response_similarities >= response_threshold)
+        if not passing.any():
+            return None
+        return int(np.argmax(np.where(passing, prompt_similarities, -np.inf)))
+
+    @staticmethod
+    def _fold(centroid: np.ndarray, embedding: np.ndarray, count: int) -> np.ndarray:
+        centroid = centroid + (embedding - centroid) / count
+        return centroid / max(np.linalg.norm(centroid), 1e-12)
+
+    def lookup(self, embedding: np.ndarray):
+        """
+        Returns the script of the closest cluster when both its prompt and
+        response centroids are similar enough to the embedding, or None.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            best = self._nearest(embedding, embedding, self.relevance_threshold)
+            return None if best is None else self.scripts[best]
+
+    def add(self, embedding: np.ndarray, response_embedding: np.ndarray, script: str):
+        """
+        Stores a script, folding it into the closest cluster when both the
+        prompt and the response are similar enough to that cluster's.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            best = self._nearest(embedding, response_embedding, self.response_threshold)
+            if best is not None:
+                self.counts[best] += 1
+                self._prompt_matrix[best] = self._fold(self._prompt_matrix[best], embedding, self.counts[best])
+                self._response_matrix[best] = self._fold(self._response_matrix[best], response_embedding, self.counts[best])
+                self.scripts[best] = script
+            else:
+                best, evicted_id = self._store_row(self._next_id, embedding, response_embedding, 1, script)
+                self._next_id += 1
+                if evicted_id is not None:
+                    self._execute("DELETE FROM clusters WHERE cluster_id = ?", (evicted_id,))
+            self._persist(best)
+
+_script_cache = SemanticScriptCache(path=SEMANTIC_CACHE_PATH)
+
+# Cache upkeep tasks still running in the background
+_background_tasks = set()
+
+async def _embed_batch_for_cache(texts: list):
+    """
+    Embeds several texts for the semantic cache in a single API call,
+    returning one unit vector per row or None on failure.
     """
-    # 1. Read the source files
     try:
-        with open(results_filepath, 'r') as f:
-            # Assumes the first line is the original query
-            original_query = json.loads(f.readline())['original_query']
-            retrieved_chunks = [json.loads(line) for line in f]
-        
-        with open(bulb_filepath, 'r') as f:
-            bulb_insight = json.load(f)['insight']
-
-    except (FileNotFoundError, KeyError, json.JSONDecodeError) as e:
-        print(f"Error reading or parsing the source files: {e}")
+        result = await genai.embed_content_async(model=CACHE_EMBEDDING_MODEL, content=list(texts), task_type="SEMANTIC_SIMILARITY")
+    except Exception as e:
+        print(f"Could not embed the podcast context for caching: {e}")
         return None
+    embeddings = np.asarray(result['embedding'], dtype=np.float32).reshape(len(texts), -1)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+async def _embed_for_cache(text: str):
+    """
+    Embeds text for the semantic cache, returning a unit vector or None on failure.
+    """
+    embeddings = await _embed_batch_for_cache([text])
+    return None if embeddings is None else embeddings[0]
+
+def _dedupe_documents(documents: list) -> list:
+    """
+    Drops documents whose text only differs from an earlier one in case or whitespace.
+    """
+    seen = set()
+    unique_documents = []
+    for document in documents:
+        key = " ".join(document.lower().split())
+        if key not in seen:
+            seen.add(key)
+            unique_documents.append(document)
+    return unique_documents
 
-    # Format the retrieved chunks for the prompt
-    formatted_chunks = "\n".join([f"- {chunk['document']}" for chunk in retrieved_chunks])
+def _iter_lines(filepath: str):
+    """
+    Yields each non-empty line of a file as bytes. The file is memory-mapped
+    and split on newlines, so lines are never decoded to str.
+    """
+    with open(filepath, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            end = len(mm)
+            while start < end:
+                nl = mm.find(b"\n", start)
+                if nl == -1:
+                    nl = end
+                line = mm[start:nl].strip()
+                if line:
+                    yield line
+                start = nl + 1
 
-    # 2. Construct the detailed podcast prompt with specific length instructions
-    prompt = f"""
-    You are a creative podcast scriptwriter. Your task is to create an engaging and informative podcast script for two speakers: Alex (the curious Host) and Ben (the knowledgeable Expert).
+def _parse_result_line(line: bytes):
+    """
+    Returns the (document, distance) of a results.jsonl record. Records in
+    the layout save_results_to_file writes are read with a regex, leaving
+    the metadata unparsed; anything else gets a full parse.
+    """
+    match = RESULT_LINE_PATTERN.match(line)
+    if match is None:
+        record = orjson.loads(line)
+        return record['document'], record.get('distance')
+    document, distance = match.groups()
+    # Only strings with escapes need a JSON decode
+    document = orjson.loads(b'"' + document + b'"') if b"\\" in document else document.decode()
+    return document, float(distance)
 
-    Use the following information to write the script:
-    - The **[Original Topic]** is the user's initial point of interest.
-    - The **[Retrieved Information]** contains relevant text chunks from the user's document library.
-    - The **[Key Insight]** is a high-level analysis that connects these chunks.
+def _scan_results(results_filepath: str):
+    # Assumes the first line is the original query; only the document text
+    # and distance of the remaining lines are kept
+    lines = _iter_lines(results_filepath)
+    try:
+        original_query = orjson.loads(next(lines))['original_query']
+    except StopIteration:
+        raise KeyError('original_query') from None
+    return original_query, [_parse_result_line(line) for line in lines]
 
-    **Instructions:**
-    1.  **Structure:** Create a podcast script with a reading time between 2 and 5 minutes (approximately 300-750 words).
-    2.  **Roles:**
-        -   **Alex (Host):** Should ask questions based on the [Original Topic].
-        -   **Ben (Expert):** Should answer by synthesizing information from the [Retrieved Information] and the [Key Insight], making comparisons and explaining connections.
-    3.  **Tone:** Make the conversation natural, engaging, and easy for a general audience to understand.
+async def _read_results(results_filepath: str):
+    """
+    Returns the original query and the document texts stored in results.jsonl,
+    most relevant (lowest distance) first when distances are present.
+    """
+    original_query, records = await asyncio.to_thread(_scan_results, results_filepath)
+    if all(isinstance(distance, (int, float)) for _, distance in records):
+        records.sort(key=lambda record: record[1])
+    return original_query, [document for document, _ in records]
 
-    ---
-    **[Original Topic]:**
-    "{original_query}"
+async def _read_insight(bulb_filepath: str) -> str:
+    """
+    Returns the insight stored in bulb.jsonl.
+    """
+    async with aiofiles.open(bulb_filepath, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        return orjson.loads(await f.read())['insight']
 
-    **[Retrieved Information]:**
-    {formatted_chunks}
+def _check_source_files(*filepaths: str):
+    """
+    Raises FileNotFoundError for the first path that is missing or empty,
+    before any file is opened.
+    """
+    for filepath in filepaths:
+        if not os.path.getsize(filepath):
+            raise FileNotFoundError(f"{filepath} is empty")
 
-    **[Key Insight]:**
-    "{bulb_insight}"
-    ---
+def _estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate of roughly four characters per token.
+    """
+    return len(text) // 4
+
+def _fit_token_budget(documents: list, budget: int) -> list:
+    """
+    Keeps the leading documents whose combined estimated size fits the budget.
+    """
+    selected = []
+    used = 0
+    for document in documents:
+        used += _estimate_tokens(document) + 1
+        if used > budget:
+            break
+        selected.append(document)
+    return selected
 
-    **Podcast Script:**
+def _build_prompt(original_query: str, documents: list, bulb_insight: str) -> str:
+    """
+    Fills the podcast template, keeping as many of the given chunks as fit the
+    token budget left after the rest of the prompt.
     """
+    chunk_budget = (PROMPT_TOKEN_BUDGET - STATIC_PROMPT_TOKENS
+                    - _estimate_tokens(original_query) - _estimate_tokens(bulb_insight))
+    selected = _fit_token_budget(documents, chunk_budget)
+    if len(selected) < len(documents):
+        print(f"Token budget reached: using {len(selected)} of {len(documents)} retrieved chunks.")
+    formatted_chunks = "\n".join("- " + document for document in selected)
+
+    # Static instructions first, then the context specific to this request
+    return PODCAST_PROMPT_TEMPLATE.substitute(
+        original_query=original_query, formatted_chunks=formatted_chunks, bulb_insight=bulb_insight
+    )
+
+async def _store_script(embedding: np.ndarray, script: str):
+    """
+    Embeds a generated script and adds it to the semantic cache.
+    """
+    response_embedding = await _embed_for_cache(script)
+    if response_embedding is not None:
+        # add() may write to SQLite, so keep it off the event loop
+        await asyncio.to_thread(_script_cache.add, embedding, response_embedding, script)
+
+def _run_in_background(coro):
+    """
+    Runs cache upkeep without delaying the current request.
+    """
+    task = asyncio.create_task(coro)
+    # Hold a reference so the task is not garbage collected while running
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def stream_podcast_script(results_filepath: str, bulb_filepath: str, model=None):
+    """
+    Reads context from results and bulb files and streams a two-speaker podcast
+    script, yielding text pieces as Gemini produces them. Yields nothing if the
+    source files cannot be read; errors from the Gemini API are raised.
+    """
+    # 1. Check both source files up front, then read them concurrently
+    try:
+        _check_source_files(results_filepath, bulb_filepath)
+    except OSError as e:
+        print(f"Source file missing or empty: {e}")
+        return
+
+    try:
+        (original_query, retrieved_documents), bulb_insight = await asyncio.gather(
+            _read_results(results_filepath), _read_insight(bulb_filepath)
+        )
+
+    except (KeyError, orjson.JSONDecodeError) as e:
+        print(f"Error parsing the source files: {e}")
+        return
+
+    # Without chunks or an insight there is nothing to ground the script in
+    if not retrieved_documents or not bulb_insight.strip():
+        print("Not enough context for a podcast script; returning the fallback script.")
+        yield FALLBACK_SCRIPT
+        return
+
+    # Reuse the script of a semantically equivalent earlier request
+    cache_embedding = await _embed_for_cache(f"{original_query} {bulb_insight}")
+    if cache_embedding is not None:
+        # The first lookup may load the cache from SQLite, so keep it off the event loop
+        cached_script = await asyncio.to_thread(_script_cache.lookup, cache_embedding)
+        if cached_script is not None:
+            print("\n--- Returning cached podcast script for a similar request ---")
+            yield cached_script
+            return
+
+    # 2. Construct the detailed podcast prompt from the unique retrieved chunks
+    unique_documents = _dedupe_documents(retrieved_documents)
+    prompt = _build_prompt(original_query, unique_documents, bulb_insight)
+
+    if model is None:
+        model = get_model()
 
     print("\n--- Sending comprehensive prompt to Gemini for podcast generation ---")
+    # 3. Call the Gemini API, passing each piece on as soon as it arrives
+    pieces = []
+    response = await model.generate_content_async(prompt, stream=True, generation_config=PODCAST_GENERATION_CONFIG)
+    async for chunk in response:
+        pieces.append(chunk.text)
+        yield chunk.text
+
+    script = "".join(pieces)
+    if cache_embedding is not None and script:
+        _run_in_background(_store_script(cache_embedding, script))
+
+async def generate_podcast_script(results_filepath: str, bulb_filepath: str, model=None):
+    """
+    Reads context from results and bulb files to generate a two-speaker podcast script.
+    Uses the shared model from get_model() when no model is passed.
+    """
     try:
-        # 3. Call the Gemini API
-        response = model.generate_content(prompt)
-        return response.text
+        return "".join([piece async for piece in stream_podcast_script(results_filepath, bulb_filepath, model)]) or None
     except Exception as e:
         print(f"An error occurred while calling the Gemini API: {e}")
         return None
@@ -74,7 +515,7 @@ if __name__ == "__main__":
         if not api_key:
             raise ValueError("GOOGLE_API_KEY not found.")
         genai.configure(api_key=api_key)
-        gemini_model = genai.GenerativeModel('gemini-pro')
+        gemini_model = get_model()
     except Exception as e:
         print(f"Error during Gemini setup: {e}")
         exit()
@@ -84,7 +525,7 @@ if __name__ == "__main__":
     bulb_file = "bulb.jsonl"
     
     # Generate the podcast script
-    podcast_script = generate_podcast_script(results_file, bulb_file, gemini_model)
+    podcast_script = asyncio.run(generate_podcast_script(results_file, bulb_file, gemini_model))
     
     # Display the final result
     if podcast_script: